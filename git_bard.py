@@ -1,16 +1,69 @@
+import asyncio
 import subprocess
 import os
 import sys
 import argparse
-import shutil
-from time import sleep
+import hashlib
+import re
+import sqlite3
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
 
 API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = os.getenv("GEMINI_API_MODEL") or "gemini-3-flash-preview"
-MAX_DIFF_CHARS = 50000
+MAX_DIFF_TOKENS = 12500
+# Hard byte ceiling while reading from git; the token budget does the real trimming.
+MAX_DIFF_CHARS = MAX_DIFF_TOKENS * 4
+DIFF_ARGS = ["--stat", "--patch", "-U1", "-M", "--no-color"]
+STREAM_CHUNK = 65536
+COMMIT_SENTINEL = re.compile(rb"\x01([0-9a-f]{40,64})\x01")
+SENTINEL_MAX_LEN = 66
+FIRST_LINE = re.compile(r"\s*([^\r\n]*)")
+SANITIZE_TABLE = dict.fromkeys([*range(0x00, 0x20), *range(0x7f, 0xa0), ord('"'), ord("`")])
+DIFF_HEADER = "commit %H%nAuthor: %an <%ae>%nDate:   %ad%n%n%w(0,4,4)%B"
+DIFF_CONCURRENCY = 16
+MAX_CONCURRENCY = 8
+VERSION_FILES = {"package.json", "pyproject.toml", "setup.py", "setup.cfg", "Cargo.toml"}
+VERSION_LINE = re.compile(r'^\s*"?version"?\s*[:=]')
+RATE_LIMIT_RPM = int(os.getenv("GEMINI_API_RPM") or 60)
+RATE_LIMIT_TPM = int(os.getenv("GEMINI_API_TPM") or 100000)
+COMMIT_RULES = (
+    "You are a strict code reviewer. Analyze the following git diff and commit metadata.\n"
+    "Write a single, professional 'Conventional Commit' message for this change.\n"
+    "Format: <type>: <description>\n"
+    "Allowed types: feat, fix, chore, docs, style, refactor, perf, test, ci, build.\n"
+    "Rules:\n"
+    "1. Keep the first line under 72 characters.\n"
+    "2. Use lowercase for the description.\n"
+    "3. Do not end with a period.\n"
+    "4. return ONLY the commit message string. No markdown, no quotes."
+)
+BATCH_RULES = (
+    "You are a strict code reviewer. Analyze the following git diffs for multiple commits.\n"
+    "Write a professional 'Conventional Commit' message for EACH commit.\n"
+    "Format for each: <type>: <description>\n"
+    "Allowed types: feat, fix, chore, docs, style, refactor, perf, test, ci, build.\n"
+    "Rules:\n"
+    "1. Keep each commit message under 72 characters.\n"
+    "2. Use lowercase for the description.\n"
+    "3. Do not end with a period.\n"
+    "4. Return ONLY the commit messages, one per line, in order.\n"
+    "5. Each line format: COMMIT#<number>: <message>\n"
+    "   Example: COMMIT#1: feat: add user authentication"
+)
+AUTHOR_LINE = re.compile(rb"^(.*) <(.*)> (\d+ [+-]\d{4})$")
+CACHE_PATH = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "git-bard", "messages.sqlite")
 
 def run(cmd, **kwargs):
-    return subprocess.run(cmd, shell=isinstance(cmd, str), capture_output=True, text=True, errors="replace", **kwargs)
+    return subprocess.run(cmd, capture_output=True, text=True, errors="replace", **kwargs)
+
+def run_raw(cmd, **kwargs):
+    return subprocess.run(cmd, capture_output=True, **kwargs)
+
+def decode(data):
+    return data.decode("utf-8", "replace")
 
 def is_git_repo():
     return run(["git", "rev-parse", "--git-dir"]).returncode == 0
@@ -22,69 +75,363 @@ def is_working_tree_clean():
     return res.stdout.strip() == ""
 
 def get_git_output(command):
-    res = run(command)
+    res = run_raw(command)
     if res.returncode != 0:
-        err = res.stderr.strip()
+        err = decode(res.stderr).strip()
         if err:
             print(f"[!] Git warning/error: {err}")
         return []
-    out = res.stdout.strip()
+    out = decode(res.stdout).strip()
     return out.splitlines() if out else []
 
 def get_all_commits():
-    return [h for h in get_git_output(["git", "log", "--reverse", "--pretty=format:%H"]) if h]
+    return get_git_output(["git", "rev-list", "--reverse", "--topo-order", "HEAD"])
 
 def get_commits_in_range(range_spec):
-    return [h for h in get_git_output(["git", "log", "--reverse", "--pretty=format:%H", range_spec]) if h]
-
-def get_commit_diff(commit_hash):
-    res = run(["git", "show", commit_hash])
+    return get_git_output(["git", "rev-list", "--reverse", "--topo-order", range_spec])
+
+def estimate_tokens(text):
+    # ~4 ASCII chars per token; multi-byte characters (CJK, emoji) cost ~1 token each.
+    extra = len(text.encode("utf-8", "replace")) - len(text)
+    return (len(text) + extra * 3 // 2) // 4
+
+def truncate_to_tokens(text, budget=MAX_DIFF_TOKENS):
+    tokens = estimate_tokens(text)
+    while tokens > budget:
+        text = text[:len(text) * budget // tokens]
+        tokens = estimate_tokens(text)
+    return text
+
+async def get_commit_diff_async(commit_hash, semaphore):
+    async with semaphore:
+        proc = await asyncio.create_subprocess_exec(
+            "git", "show", *DIFF_ARGS, f"--pretty=format:{DIFF_HEADER}", commit_hash,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            data = await proc.stdout.readexactly(MAX_DIFF_CHARS)
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+        except asyncio.IncompleteReadError as e:
+            data = e.partial
+            if await proc.wait() != 0:
+                print(f"[!] Could not get diff for {commit_hash[:7]}")
+                return ""
+    return truncate_to_tokens(decode(data))
+
+async def fetch_diffs_async(hashes, concurrency=DIFF_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+    diffs = await asyncio.gather(*(get_commit_diff_async(h, semaphore) for h in hashes))
+    return dict(zip(hashes, diffs))
+
+def collect_diffs(hashes):
+    diffs = prefetch_diffs(hashes)
+    missing = [h for h in hashes if h not in diffs]
+    if missing:
+        diffs.update(asyncio.run(fetch_diffs_async(missing)))
+    return diffs
+
+def prefetch_diffs(hashes):
+    # diff-tree answers each hash as it reads it, so feed stdin from a file
+    # rather than a pipe we would have to write while also draining stdout.
+    with tempfile.TemporaryFile() as todo, tempfile.TemporaryFile() as errors:
+        todo.write(("\n".join(hashes) + "\n").encode())
+        todo.seek(0)
+        proc = subprocess.Popen(
+            ["git", "diff-tree", *DIFF_ARGS, "--cc", "--stdin", "--root", "--always",
+             f"--pretty=format:%x01%H%x01{DIFF_HEADER}"],
+            stdin=todo, stdout=subprocess.PIPE, stderr=errors,
+        )
+        with proc:
+            diffs = read_diff_stream(proc.stdout)
+            returncode = proc.wait()
+        if returncode != 0:
+            errors.seek(0)
+            err = decode(errors.read()).strip()
+            if err:
+                print(f"[!] Git warning/error: {err}")
+            return {}
+    return diffs
+
+def read_diff_stream(stream):
+    diffs = {}
+    current = None
+    body = bytearray()
+    size = 0
+    pending = b""
+
+    def keep(data):
+        nonlocal size
+        if current is None:
+            return
+        size += len(data)
+        if len(body) < MAX_DIFF_CHARS:
+            body.extend(data[:MAX_DIFF_CHARS - len(body)])
+
+    while True:
+        chunk = stream.read(STREAM_CHUNK)
+        pending += chunk
+        pos = 0
+        for match in COMMIT_SENTINEL.finditer(pending):
+            keep(pending[pos:match.start()])
+            if current is not None:
+                # diff-tree separates entries with a newline that git show does not print.
+                if size <= MAX_DIFF_CHARS and body.endswith(b"\n"):
+                    del body[-1]
+                diffs[current] = truncate_to_tokens(decode(body))
+            current = match.group(1).decode()
+            body = bytearray()
+            size = 0
+            pos = match.end()
+        rest = pending[pos:]
+        if not chunk:
+            keep(rest)
+            break
+        # Hold back enough bytes to complete a sentinel split across reads.
+        split = max(0, len(rest) - SENTINEL_MAX_LEN)
+        keep(rest[:split])
+        pending = rest[split:]
+    if current is not None:
+        diffs[current] = truncate_to_tokens(decode(body))
+    return diffs
+
+def get_merge_commits(hashes):
+    res = run_raw(["git", "rev-list", "--no-walk=unsorted", "--min-parents=2", "--stdin"], input=("\n".join(hashes) + "\n").encode())
+    if res.returncode != 0:
+        return set()
+    return set(decode(res.stdout).split())
+
+def get_diff_stats(hashes, ignore_whitespace=False):
+    cmd = ["git", "diff-tree", "--stdin", "--root", "--always", "-r", "--numstat", "--format=%x01%H"]
+    if ignore_whitespace:
+        cmd.append("-w")
+    res = run_raw(cmd, input=("\n".join(hashes) + "\n").encode())
     if res.returncode != 0:
-        print(f"[!] Could not get diff for {commit_hash[:7]}")
-        return ""
-    return res.stdout[:MAX_DIFF_CHARS]
+        return {}
+    stats = {}
+    current = None
+    for line in decode(res.stdout).splitlines():
+        if line.startswith("\x01"):
+            current = stats.setdefault(line[1:], [])
+        elif line and current is not None:
+            added, removed, path = line.split("\t", 2)
+            current.append((added, removed, path))
+    return stats
+
+def is_whitespace_only(stats, ws_stats):
+    # Every file has a real text change, and none survive `git diff -w`.
+    return bool(stats) and not ws_stats and all(a != "-" and (a, r) != ("0", "0") for a, r, _ in stats)
+
+def trivial_message(diff_content, stats=None, ws_stats=None, is_merge=False):
+    if is_merge:
+        return "chore: merge branch"
+    if stats is None:
+        return None
+    if not stats:
+        return "chore: empty commit"
+    if ws_stats is not None and is_whitespace_only(stats, ws_stats):
+        return "style: whitespace"
+    if all(os.path.basename(path) in VERSION_FILES for _, _, path in stats):
+        changed = []
+        in_patch = False
+        for line in diff_content.splitlines():
+            if line.startswith("diff --git "):
+                in_patch = True
+            elif in_patch and line.startswith(("-", "+")) and not line.startswith(("--- ", "+++ ")):
+                changed.append(line[1:])
+        # A line count short of numstat's means the diff text was truncated.
+        expected = sum(int(a) + int(r) for a, r, _ in stats if a != "-")
+        if changed and len(changed) == expected and all(VERSION_LINE.match(l) for l in changed):
+            return "chore: bump version"
+    return None
+
+def find_trivial_messages(diffs):
+    hashes = list(diffs)
+    merges = get_merge_commits(hashes)
+    stats = get_diff_stats(hashes)
+    ws_stats = get_diff_stats(hashes, ignore_whitespace=True)
+    shortcuts = {}
+    for commit_hash, diff in diffs.items():
+        msg = trivial_message(diff, stats.get(commit_hash), ws_stats.get(commit_hash), commit_hash in merges) if diff else None
+        if msg:
+            shortcuts[commit_hash] = msg
+    if shortcuts:
+        print(f"    [i] {len(shortcuts)} trivial commits labelled without Gemini.")
+    return shortcuts
 
 def sanitize_commit_message(msg):
     if not msg:
         return None
-    msg = msg.replace('\r\n', '\n').replace('\r', '\n').split('\n')[0].strip()
-    msg = ''.join(c for c in msg if c.isprintable())
+    msg = FIRST_LINE.match(msg).group(1).translate(SANITIZE_TABLE).strip()
+    if not msg.isprintable():
+        msg = ''.join(c for c in msg if c.isprintable())
     msg = msg[:200]
     if not msg:
         return None
     return msg
 
-def generate_conventional_message(client, diff_content, retries=3):
-    prompt = (
-        "You are a strict code reviewer. Analyze the following git diff and commit metadata.\n"
-        "Write a single, professional 'Conventional Commit' message for this change.\n"
-        "Format: <type>: <description>\n"
-        "Allowed types: feat, fix, chore, docs, style, refactor, perf, test, ci, build.\n"
-        "Rules:\n"
-        "1. Keep the first line under 72 characters.\n"
-        "2. Use lowercase for the description.\n"
-        "3. Do not end with a period.\n"
-        "4. return ONLY the commit message string. No markdown, no quotes.\n\n"
-        f"DIFF:\n{diff_content}"
-    )
+class MessageCache:
+    def __init__(self, path=CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS messages (key TEXT PRIMARY KEY, message TEXT NOT NULL)")
 
-    for attempt in range(retries):
+    @staticmethod
+    def key(diff_content):
+        return hashlib.blake2b(f"{MODEL_NAME}\0{diff_content}".encode(), digest_size=16).hexdigest()
+
+    def get(self, diff_content):
+        row = self.conn.execute("SELECT message FROM messages WHERE key = ?", (self.key(diff_content),)).fetchone()
+        return row[0] if row else None
+
+    def put(self, diff_content, message):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO messages (key, message) VALUES (?, ?)", (self.key(diff_content), message))
+
+def open_message_cache():
+    try:
+        return MessageCache()
+    except (OSError, sqlite3.Error) as e:
+        print(f"    [!] Message cache unavailable: {e}")
+        return None
+
+class RateLimiter:
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, window=60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self.calls = deque()
+        self.tokens = 0
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _expire(self, now):
+        while self.calls and now - self.calls[0][0] >= self.window:
+            _, tokens = self.calls.popleft()
+            self.tokens -= tokens
+
+    async def acquire(self, tokens=0):
+        while True:
+            async with self.lock:
+                now = monotonic()
+                self._expire(now)
+                if now >= self.blocked_until:
+                    if not self.calls or (len(self.calls) < self.rpm and self.tokens + tokens <= self.tpm):
+                        self.calls.append((now, tokens))
+                        self.tokens += tokens
+                        return
+                    wait = self.window - (now - self.calls[0][0])
+                else:
+                    wait = self.blocked_until - now
+            await asyncio.sleep(max(wait, 0.05))
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+
+class AIMDController:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, increase=1, decrease=0.5):
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        # Start at full width; 429s halve it and successes grow it back.
+        self.limit = max_concurrency
+        self.active = 0
+        self.backoff_until = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    async def on_success(self):
+        async with self.condition:
+            self.limit = min(self.max_concurrency, self.limit + self.increase)
+            self.condition.notify_all()
+
+    async def on_throttle(self, delay):
+        async with self.condition:
+            # Requests already in flight fail together; count them as one signal.
+            if monotonic() < self.backoff_until:
+                return
+            self.limit = max(1, self.limit * self.decrease)
+            self.backoff_until = monotonic() + delay
+
+def is_rate_limited(error):
+    return getattr(error, "code", None) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+def parse_retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    if value:
         try:
-            response = client.models.generate_content(model=MODEL_NAME, contents=prompt)
-            if getattr(response, "text", None):
-                text = response.text.strip().replace('"', '').replace("`", "")
-                text = sanitize_commit_message(text)
-                if text:
-                    return text
-            print(f"   [!] Empty response (attempt {attempt+1}/{retries})")
-        except Exception as e:
-            print(f"   [!] API Error: {e} (attempt {attempt+1}/{retries})")
+            return float(value)
+        except ValueError:
+            pass
+    match = re.search(r"retryDelay'?\"?:\s*'?\"?(\d+(?:\.\d+)?)s", str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+async def generate_conventional_message_async(client, diff_content, limiter=None, controller=None, cache=None, retries=3):
+    prompt = f"DIFF:\n{diff_content}"
+
+    if cache:
+        cached = cache.get(diff_content)
+        if cached:
+            return cached
+
+    limiter = limiter or RateLimiter()
+    controller = controller or AIMDController()
+    for attempt in range(retries):
+        delay = 2 ** attempt
+        async with controller:
+            await limiter.acquire(estimate_tokens(prompt))
+            try:
+                response = await client.aio.models.generate_content(
+                    model=MODEL_NAME, contents=prompt, config={"system_instruction": COMMIT_RULES}
+                )
+                await controller.on_success()
+                if getattr(response, "text", None):
+                    text = sanitize_commit_message(response.text)
+                    if text:
+                        if cache:
+                            cache.put(diff_content, text)
+                        return text
+                print(f"   [!] Empty response (attempt {attempt+1}/{retries})")
+            except Exception as e:
+                if is_rate_limited(e):
+                    delay = parse_retry_after(e) or delay
+                    await controller.on_throttle(delay)
+                    limiter.block(delay)
+                    if attempt < retries - 1:
+                        print(f"   [!] Rate limited, retrying in {delay:g}s (attempt {attempt+1}/{retries})")
+                    else:
+                        print(f"   [!] Rate limited (attempt {attempt+1}/{retries})")
+                else:
+                    print(f"   [!] API Error: {e} (attempt {attempt+1}/{retries})")
         
         if attempt < retries - 1:
-            sleep(2 ** attempt)
+            await asyncio.sleep(delay)
     
     return None
 
+async def generate_all_messages(client, diffs, cache=None):
+    limiter = RateLimiter()
+    controller = AIMDController()
+    return await asyncio.gather(*(generate_conventional_message_async(client, d, limiter, controller, cache) for d in diffs))
+
 def generate_batch_messages(client, commits_with_diffs, retries=3):
     commit_sections = []
     for i, (commit_hash, diff) in enumerate(commits_with_diffs):
@@ -92,24 +439,13 @@ def generate_batch_messages(client, commits_with_diffs, retries=3):
     
     all_diffs = "\n\n".join(commit_sections)
     
-    prompt = (
-        "You are a strict code reviewer. Analyze the following git diffs for multiple commits.\n"
-        "Write a professional 'Conventional Commit' message for EACH commit.\n"
-        "Format for each: <type>: <description>\n"
-        "Allowed types: feat, fix, chore, docs, style, refactor, perf, test, ci, build.\n"
-        "Rules:\n"
-        "1. Keep each commit message under 72 characters.\n"
-        "2. Use lowercase for the description.\n"
-        "3. Do not end with a period.\n"
-        "4. Return ONLY the commit messages, one per line, in order.\n"
-        "5. Each line format: COMMIT#<number>: <message>\n"
-        "   Example: COMMIT#1: feat: add user authentication\n\n"
-        f"DIFFS:\n{all_diffs}"
-    )
+    prompt = f"DIFFS:\n{all_diffs}"
 
     for attempt in range(retries):
         try:
-            response = client.models.generate_content(model=MODEL_NAME, contents=prompt)
+            response = client.models.generate_content(
+                model=MODEL_NAME, contents=prompt, config={"system_instruction": BATCH_RULES}
+            )
             if getattr(response, "text", None):
                 text = response.text.strip()
                 if text:
@@ -120,7 +456,7 @@ def generate_batch_messages(client, commits_with_diffs, retries=3):
                             try:
                                 num_part, msg = line.split(": ", 1)
                                 num = int(num_part.replace("COMMIT#", ""))
-                                msg = sanitize_commit_message(msg.replace('"', '').replace("`", ""))
+                                msg = sanitize_commit_message(msg)
                                 if msg:
                                     messages[num] = msg
                             except (ValueError, IndexError):
@@ -138,42 +474,128 @@ def generate_batch_messages(client, commits_with_diffs, retries=3):
     
     return None
 
-def check_cmsg_installed():
-    if shutil.which("cmsg") is None:
-        print("[X] Error: 'cmsg' tool not found.")
-        print("   Please install it: https://github.com/ogpourya/cmsg")
-        sys.exit(1)
+def read_commit_objects(hashes):
+    with tempfile.TemporaryFile() as todo:
+        todo.write(("\n".join(hashes) + "\n").encode())
+        todo.seek(0)
+        res = subprocess.run(["git", "cat-file", "--batch"], stdin=todo, capture_output=True)
+    if res.returncode != 0:
+        return {}
+    objects = {}
+    data = res.stdout
+    pos = 0
+    for commit_hash in hashes:
+        eol = data.index(b"\n", pos)
+        size = int(data[pos:eol].split()[2])
+        objects[commit_hash] = data[eol + 1:eol + 1 + size]
+        pos = eol + 1 + size + 1
+    return objects
+
+def parse_commit_object(raw):
+    headers, _, message = raw.partition(b"\n\n")
+    commit = {"parents": [], "message": message, "encoding": None}
+    for line in headers.split(b"\n"):
+        key, _, value = line.partition(b" ")
+        if key == b"tree":
+            commit["tree"] = value.decode()
+        elif key == b"parent":
+            commit["parents"].append(value.decode())
+        elif key in (b"author", b"committer"):
+            commit[key.decode()] = AUTHOR_LINE.match(value).groups()
+        elif key == b"encoding":
+            commit["encoding"] = value.decode()
+    return commit
+
+def commit_tree(commit, parents, message, encoding=None):
+    env = dict(os.environ)
+    for role in ("author", "committer"):
+        name, email, date = (v.decode("utf-8", "surrogateescape") for v in commit[role])
+        prefix = f"GIT_{role.upper()}_"
+        env[prefix + "NAME"] = name
+        env[prefix + "EMAIL"] = email
+        env[prefix + "DATE"] = "@" + date
+    cmd = ["git"]
+    if encoding:
+        cmd += ["-c", f"i18n.commitEncoding={encoding}"]
+    cmd += ["commit-tree", commit["tree"]]
+    for parent in parents:
+        cmd += ["-p", parent]
+    res = run_raw(cmd, input=message, env=env)
+    if res.returncode != 0:
+        return None
+    return decode(res.stdout).strip()
+
+def reword_commits(messages, oldest_hash):
+    # Rebuild commits from their original trees instead of replaying them, so
+    # merges keep any manual resolution and only the messages change.
+    parent = run(["git", "rev-parse", "--verify", "-q", f"{oldest_hash}^"])
+    range_spec = f"{parent.stdout.strip()}..HEAD" if parent.returncode == 0 else "HEAD"
+    order = get_git_output(["git", "rev-list", "--reverse", "--topo-order", range_spec])
+    objects = read_commit_objects(order)
+    if len(objects) != len(order):
+        return "Could not read commit objects."
+
+    mapping = {}
+    reworded = set()
+    for commit_hash in order:
+        commit = parse_commit_object(objects[commit_hash])
+        parents = [mapping.get(p, p) for p in commit["parents"]]
+        if commit_hash in messages:
+            message, encoding = (messages[commit_hash] + "\n").encode(), None
+        elif parents != commit["parents"]:
+            # Original bytes are copied as-is, so keep their declared encoding.
+            message, encoding = commit["message"], commit["encoding"]
+        else:
+            continue
+        new_hash = commit_tree(commit, parents, message, encoding)
+        if not new_hash:
+            return f"git commit-tree failed for {commit_hash[:7]}."
+        mapping[commit_hash] = new_hash
+        if commit_hash in messages:
+            reworded.add(commit_hash)
+
+    skipped = [h[:7] for h in messages if h not in reworded]
+    if skipped:
+        return f"Commits not reachable from HEAD: {', '.join(skipped)}. Nothing was changed."
+
+    old_head = order[-1]
+    new_head = mapping.get(old_head, old_head)
+    res = run(["git", "update-ref", "-m", "git-bard: reword commits", "HEAD", new_head, old_head])
+    if res.returncode != 0:
+        return res.stderr.strip() or "git update-ref failed."
+    return None
+
+def import_genai():
+    from google import genai
+    return genai
 
 def main():
     parser = argparse.ArgumentParser(description="Rewrite git history with AI-generated conventional commit messages.")
     parser.add_argument("commit_range", nargs="?", help="Git commit range (e.g., HEAD~5..HEAD, origin/main..HEAD). Defaults to ALL commits.")
     parser.add_argument("--yes", action="store_true", help="Skip all confirmation prompts.")
     parser.add_argument("--crazy", action="store_true", help="Use a single AI request for all commits (faster but less reliable).")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and do not update the local message cache.")
     args = parser.parse_args()
 
-    if not is_git_repo():
+    # google-genai is slow to import; load it while the git checks run.
+    pool = ThreadPoolExecutor(max_workers=3)
+    genai_future = pool.submit(import_genai)
+    repo_future = pool.submit(is_git_repo)
+    clean_future = pool.submit(is_working_tree_clean)
+    pool.shutdown(wait=False)
+
+    if not repo_future.result():
         print("[!] Not a git repository. Aborting.")
         sys.exit(1)
 
-    if not is_working_tree_clean():
+    if not clean_future.result():
         print("[!] Working tree is not clean. Stash or commit changes.")
         sys.exit(1)
 
-    check_cmsg_installed()
-
-    try:
-        from google import genai
-    except Exception as e:
-        print(f"[!] Failed to import Gemini client library: {e}")
-        print("   Make sure the library is installed and importable.")
-        sys.exit(1)
-
     if not API_KEY:
         print("[!] Please set the GEMINI_API_KEY environment variable.")
         sys.exit(1)
 
-    client = genai.Client(api_key=API_KEY)
-
     print(f"\n[*] Git Bard: Tuning instruments...")
     if os.getenv("GEMINI_API_MODEL"):
         print(f"    - Model: {MODEL_NAME}")
@@ -185,6 +607,16 @@ def main():
         print(f"\n[X] Error: No commits found.")
         sys.exit(1)
 
+    try:
+        genai = genai_future.result()
+    except Exception as e:
+        print(f"[!] Failed to import Gemini client library: {e}")
+        print("   Make sure the library is installed and importable.")
+        sys.exit(1)
+
+    client = genai.Client(api_key=API_KEY)
+
+    hash_to_idx = {h: i for i, h in enumerate(all_initial_commits)}
     target_indices = []
 
     if args.commit_range:
@@ -198,11 +630,9 @@ def main():
                 print(f"\n[X] Error: No commits in range.")
                 sys.exit(1)
             for h in target_hashes:
-                try:
-                    idx = all_initial_commits.index(h)
+                idx = hash_to_idx.get(h)
+                if idx is not None:
                     target_indices.append(idx)
-                except ValueError:
-                    pass
             target_indices.sort()
     else:
         print(f"    - Range:  All commits")
@@ -230,93 +660,84 @@ def main():
         
         indices_oldest_first = list(reversed(target_indices))
         
+        diffs = collect_diffs([all_initial_commits[i] for i in indices_oldest_first])
+        new_messages = find_trivial_messages(diffs)
+        cache = None if args.no_cache else open_message_cache()
         commits_with_diffs = []
         for index in indices_oldest_first:
             target_hash = all_initial_commits[index]
-            diff = get_commit_diff(target_hash)
-            if diff:
-                commits_with_diffs.append((index, target_hash, diff))
+            diff = diffs.get(target_hash)
+            if diff and target_hash not in new_messages:
+                cached = cache.get(diff) if cache else None
+                if cached:
+                    new_messages[target_hash] = cached
+                else:
+                    commits_with_diffs.append((index, target_hash, diff))
         
-        if not commits_with_diffs:
+        if not commits_with_diffs and not new_messages:
             print("[X] No valid diffs found.")
             sys.exit(1)
         
-        prompt_data = [(h, d) for (_, h, d) in commits_with_diffs]
-        
-        print(f"[*] Composing {len(commits_with_diffs)} messages in one request...")
-        messages = generate_batch_messages(client, prompt_data)
-        if messages is None:
-            print("[X] API failure. Could not generate batch messages.")
-            sys.exit(1)
-        
-        missing = [i for i in range(1, len(commits_with_diffs) + 1) if not messages.get(i)]
-        if missing:
-            print(f"[X] API returned incomplete messages. Missing: {missing}")
-            sys.exit(1)
-        
-        print("[*] Applying messages (newest to oldest)...")
-        crazy_total = len(commits_with_diffs)
-        for step, (index, _, _) in enumerate(reversed(commits_with_diffs)):
-            msg_num = crazy_total - step
-            new_msg = messages[msg_num]
+        if commits_with_diffs:
+            prompt_data = [(h, d) for (_, h, d) in commits_with_diffs]
             
-            current_history = get_all_commits()
-            if index >= len(current_history):
-                print(f"[X] Index {index} out of bounds. History corrupted?")
+            print(f"[*] Composing {len(commits_with_diffs)} messages in one request...")
+            messages = generate_batch_messages(client, prompt_data)
+            if messages is None:
+                print("[X] API failure. Could not generate batch messages.")
                 sys.exit(1)
             
-            current_hash = current_history[index]
-            print(f"\n[{step+1}/{crazy_total}] Commit {current_hash[:7]}")
-            print(f"    [+] Message: {new_msg}")
-            
-            if new_msg.startswith("-"):
-                new_msg = " " + new_msg
-            
-            print(f"    [#] Reforging...", end="\r")
-            proc = run(["cmsg", "-c", current_hash, "-m", new_msg])
-            if proc.returncode != 0:
-                print(f"\n    [X] Rewrite failed at {current_hash[:7]}.")
-                print(f"    [i] Check 'git status'. You may need to 'git rebase --abort' or '--continue'.")
+            missing = [i for i in range(1, len(commits_with_diffs) + 1) if not messages.get(i)]
+            if missing:
+                print(f"[X] API returned incomplete messages. Missing: {missing}")
                 sys.exit(1)
             
-            print("    [V] Success.   ")
-            sleep(0.1)
+            new_messages.update((h, messages[i + 1]) for i, (_, h, _) in enumerate(commits_with_diffs))
+            if cache:
+                for i, (_, _, d) in enumerate(commits_with_diffs):
+                    cache.put(d, messages[i + 1])
     else:
-        for step, index in enumerate(target_indices):
-            current_history = get_all_commits()
-            if index >= len(current_history):
-                print(f"[!] Index {index} is out of bounds (history shortened?). Skipping.")
-                continue
-
-            target_hash = current_history[index]
-            print(f"\n[{step+1}/{total_ops}] Commit {target_hash[:7]}")
-
-            diff = get_commit_diff(target_hash)
+        print("[*] Fetching diffs...")
+        diffs = collect_diffs([all_initial_commits[i] for i in target_indices])
+        new_messages = find_trivial_messages(diffs)
+        pending = []
+        for index in target_indices:
+            target_hash = all_initial_commits[index]
+            diff = diffs.get(target_hash)
             if not diff:
-                print("    [!] Empty diff, skipping.")
+                print(f"    [!] Empty diff for {target_hash[:7]}, skipping.")
                 continue
+            if target_hash not in new_messages:
+                pending.append((index, diff))
+
+        if not pending and not new_messages:
+            print("[X] No valid diffs found.")
+            sys.exit(1)
 
-            print("    [*] Composing...", end="\r")
-            new_msg = generate_conventional_message(client, diff)
-            if new_msg is None:
-                print(f"\n    [X] API failure. Stopping.")
-                print(f"    [i] Progress saved. You may need to 'git rebase --abort' if a rebase is in progress.")
+        if pending:
+            print(f"[*] Composing {len(pending)} messages (up to {MAX_CONCURRENCY} at once, {RATE_LIMIT_RPM} RPM)...")
+            cache = None if args.no_cache else open_message_cache()
+            messages = asyncio.run(generate_all_messages(client, [d for (_, d) in pending], cache))
+            if any(m is None for m in messages):
+                print("[X] API failure. Stopping.")
+                print("[i] No commits were rewritten.")
                 sys.exit(1)
-                
-            print(f"    [+] Message: {new_msg}")
 
-            if new_msg.startswith("-"):
-                new_msg = " " + new_msg
+            new_messages.update((all_initial_commits[index], msg) for ((index, _), msg) in zip(pending, messages))
 
-            print(f"    [#] Reforging...", end="\r")
-            proc = run(["cmsg", "-c", target_hash, "-m", new_msg])
-            if proc.returncode != 0:
-                print(f"\n    [X] Rewrite failed at {target_hash[:7]}.")
-                print(f"    [i] Check 'git status'. You may need to 'git rebase --abort' or '--continue'.")
-                sys.exit(1)
+    new_messages = {h: new_messages[h] for h in sorted(new_messages, key=hash_to_idx.get, reverse=True)}
+    oldest_hash = list(new_messages)[-1]
+    print(f"[*] Applying {len(new_messages)} messages...")
+    for commit_hash, new_msg in new_messages.items():
+        print(f"    [+] {commit_hash[:7]} {new_msg}")
 
-            print("    [V] Success.   ")
-            sleep(0.1)
+    print(f"    [#] Reforging...", end="\r")
+    err = reword_commits(new_messages, oldest_hash)
+    if err:
+        print(f"\n    [X] Rewrite failed.")
+        print(f"    [!] {err}")
+        sys.exit(1)
+    print("    [V] Success.   ")
 
     print(f"\n[!] The saga is complete.")
     if args.yes: